@@ -1,5 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import zipfile
+
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import seaborn as sns
 
 
@@ -10,60 +17,589 @@ pd.set_option("display.max_rows", None)
 pd.set_option("display.max_columns", None)
 
 
-class BabyNames:
-    def __init__(self, names_df):
-        self.names = names_df
+# Column names of the yearly files and compact dtypes of the consolidated table
+NAMES_COLUMNS = ["name", "sex", "birth"]
+NAMES_DTYPES = {"name": "category", "sex": "category", "year": "int16", "birth": "int32"}
 
-    def total_births_count(self):
-        # Count total births
-        total_births = self.names.pivot_table(
-            values="birth",
-            index="year",
-            columns="sex",
-            aggfunc="sum"
+
+def read_year_file(directory, year):
+    # Read one yearly file and add the 'year' column
+    names = pd.read_csv(
+        os.path.join(directory, f"yob{year}.txt"),
+        names=NAMES_COLUMNS,
+        dtype={"birth": np.int32},
+    )
+    return names.assign(year=np.int16(year))
+
+
+def load_store(store_path):
+    # Get the consolidated table and the (mtime, size) of the source file of each year
+    try:
+        with np.load(store_path) as store:
+            names = pd.DataFrame(
+                {
+                    "name": pd.Categorical.from_codes(
+                        store["name.codes"], store["name.categories"].astype(object)
+                    ),
+                    "sex": pd.Categorical.from_codes(
+                        store["sex.codes"], store["sex.categories"].astype(object)
+                    ),
+                    "birth": store["birth"],
+                    "year": store["year"],
+                }
+            )
+            sources = {
+                year: (mtime, size)
+                for year, mtime, size in zip(
+                    store["source_years"].tolist(),
+                    store["source_mtimes"].tolist(),
+                    store["source_sizes"].tolist(),
+                )
+            }
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None, {}
+
+    return names, sources
+
+
+def save_store(store_path, names, sources):
+    arrays = {
+        "year": names["year"].to_numpy(),
+        "birth": names["birth"].to_numpy(),
+        "source_years": np.array(list(sources), dtype=np.int64),
+        "source_mtimes": np.array([mtime for mtime, _ in sources.values()]),
+        "source_sizes": np.array([size for _, size in sources.values()]),
+    }
+    for column in ["name", "sex"]:
+        arrays[f"{column}.codes"] = names[column].cat.codes.to_numpy()
+        arrays[f"{column}.categories"] = names[column].cat.categories.to_numpy(dtype=str)
+
+    # Write to a temporary file and replace the store, skip saving if the dataset folder is read-only
+    temp_path = f"{store_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, store_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def load_babynames(directory, years=range(1880, 2011), store_path=None, max_workers=None):
+    # Get the current (mtime, size) of each yearly file
+    sources = {}
+    for year in years:
+        stat = os.stat(os.path.join(directory, f"yob{year}.txt"))
+        sources[year] = (stat.st_mtime_ns, stat.st_size)
+
+    # Reuse the stored years whose files are unchanged
+    stored, stored_sources = (
+        load_store(store_path) if store_path is not None else (None, {})
+    )
+    fresh = [year for year in years if stored_sources.get(year) == sources[year]]
+    stale = [year for year in years if year not in fresh]
+    if not stale:
+        return stored[stored["year"].isin(fresh)].reset_index(drop=True)
+
+    # Read the new and changed yearly files in parallel
+    with ThreadPoolExecutor(max_workers) as executor:
+        pieces = list(executor.map(lambda year: read_year_file(directory, year), stale))
+    names = pd.concat(pieces, ignore_index=True)
+
+    # Add the stored years extending their categories with the new values
+    if fresh:
+        kept = stored[stored["year"].isin(fresh)]
+        for column in ["name", "sex"]:
+            categories = kept[column].cat.categories
+            categories = categories.append(
+                pd.Index(names[column].unique()).difference(categories)
+            )
+            names[column] = pd.Categorical(names[column], categories=categories)
+            kept = kept.assign(**{column: kept[column].cat.set_categories(categories)})
+        names = pd.concat([names, kept], ignore_index=True)
+
+    # Order all data by year and use compact dtypes
+    names = names.sort_values("year", kind="stable", ignore_index=True)
+    names = names.astype(NAMES_DTYPES)
+
+    if store_path is not None:
+        save_store(store_path, names, sources)
+
+    return names
+
+
+def count_total_births(names):
+    # Count total births
+    total_births = names.pivot_table(
+        values="birth",
+        index="year",
+        columns="sex",
+        aggfunc="sum",
+        observed=True,
+    )
+    return total_births
+
+
+def year_fingerprints(names):
+    # Hash the rows of each year in order, to check a saved matrix against the table
+    row_hashes = pd.util.hash_pandas_object(
+        names[["name", "sex", "year", "birth"]], index=False
+    ).to_numpy()
+    years = names["year"].to_numpy()
+    order = np.argsort(years, kind="stable")
+    row_hashes = row_hashes[order]
+    years = years[order]
+    bounds = np.r_[np.flatnonzero(np.r_[True, years[1:] != years[:-1]]), len(years)]
+
+    return [
+        hashlib.sha256(row_hashes[start:end].tobytes()).hexdigest()
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def alphabetical_codes(values):
+    # Get integer codes of the values following their alphabetical order
+    values = values.astype("category")
+    ranks = values.cat.categories.argsort().argsort()
+
+    return ranks[values.cat.codes.to_numpy()], len(ranks)
+
+
+def rank_names(names):
+    # Sort the names by year, sex, births (descending) and name
+    name_ranks, names_count = alphabetical_codes(names["name"])
+    sex_ranks, sexes_count = alphabetical_codes(names["sex"])
+    years = names["year"].to_numpy()
+    births = names["birth"].to_numpy()
+
+    # Pack the sort keys into one integer key for a single argsort
+    groups = (years.astype(np.int64) - years.min()) * sexes_count + sex_ranks
+    keys = groups * (births.max() + 1) + (births.max() - births)
+    order = np.argsort(keys * names_count + name_ranks)
+
+    # Get the offsets of each (year, sex) group in the sorted order
+    groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+
+    return order, np.r_[starts, len(order)]
+
+
+def select_top_names(names, order, offsets, k):
+    # Take the first k positions of each (year, sex) group
+    sizes = np.minimum(np.diff(offsets), k)
+    ranks = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    positions = np.repeat(offsets[:-1], sizes) + ranks
+
+    top = names.iloc[order[positions]][["year", "sex", "name", "birth"]]
+    top = top.astype({"sex": str, "name": str})
+
+    return top.assign(rank=ranks + 1).reset_index(drop=True)
+
+
+class NameYearMatrix:
+    def __init__(self, path=None):
+        # Births of each (name, sex) row by year in one flat int32 array, year by year,
+        # every year block holds the rows known up to that year
+        self.path = path
+        self.keys = []
+        self.index = {}
+        self.years = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.totals = None
+        self.fingerprints = []
+        self.births = np.empty(0, dtype=np.int32)
+        # In memory the births are a view of a larger buffer, grown by doubling
+        self.buffer = self.births
+
+    @classmethod
+    def build(cls, names_df, totals, path=None, fingerprints=None):
+        # Number the (name, sex) rows in order of their first year
+        names = names_df.sort_values("year", kind="stable")
+        name = names["name"].astype("category")
+        sex = names["sex"].astype("category")
+        sexes_count = len(sex.cat.categories)
+        rows, keys = pd.factorize(
+            name.cat.codes.to_numpy(np.int64) * sexes_count + sex.cat.codes.to_numpy()
+        )
+        name_codes, sex_codes = np.divmod(keys, sexes_count)
+
+        # Get the length of each year block, the rows seen up to that year
+        years = names["year"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+        lengths = np.maximum.accumulate(np.maximum.reduceat(rows, starts)) + 1
+        offsets = np.r_[0, np.cumsum(lengths)]
+
+        # Fill the year blocks with births
+        year_positions = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(years)]))
+        births = np.bincount(
+            offsets[year_positions] + rows,
+            weights=names["birth"].to_numpy(),
+            minlength=offsets[-1],
         )
-        return total_births
 
-    def names_popularity_count(self):
-        # Filter DataFrame by Gender (Male) and Popularity (minimum one name per day in year)
-        popular_boys_names = self.names.loc[(self.names["sex"] == "M") &
-                                            (self.names["birth"] >= 365)]
-
-        # Filter DataFrame by Gender (Female) and Popularity (minimum one name per day in year)
-        popular_girls_names = self.names.loc[(self.names["sex"] == "F") &
-                                             (self.names["birth"] >= 365)]
-
-        # Create a table of popular boys' names by each year
-        count_boys_names = popular_boys_names.pivot_table(
-            values="birth",
-            index="name",
-            columns="year",
-            aggfunc="max",
-            dropna=True,
-            fill_value=0,
+        matrix = cls(path)
+        matrix.keys = list(
+            zip(
+                name.cat.categories[name_codes].astype(str).tolist(),
+                sex.cat.categories[sex_codes].astype(str).tolist(),
+            )
+        )
+        matrix.index = {key: row for row, key in enumerate(matrix.keys)}
+        matrix.years = years[starts].astype(np.int64)
+        matrix.lengths = lengths.astype(np.int64)
+        matrix.offsets = offsets.astype(np.int64)
+        matrix.totals = totals
+        matrix.fingerprints = (
+            year_fingerprints(names_df) if fingerprints is None else fingerprints
+        )
+        matrix.write(births.astype(np.int32))
+
+        return matrix
+
+    def write(self, births):
+        if self.path is None:
+            self.births = births
+            self.buffer = births
+            return
+
+        # Save the year blocks as raw int32 and the rows index next to them
+        births.tofile(f"{self.path}.bin")
+        self.save_index()
+        self.births = np.memmap(f"{self.path}.bin", dtype=np.int32, mode="r")
+
+    def save_index(self):
+        # Write to a temporary file and replace the index, so a broken save is never loaded
+        temp_path = f"{self.path}.npz.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(
+                file,
+                names=np.array([name for name, _ in self.keys], dtype=str),
+                sexes=np.array([sex for _, sex in self.keys], dtype=str),
+                years=self.years,
+                lengths=self.lengths,
+                totals=self.totals.to_numpy(dtype=np.float64),
+                totals_years=self.totals.index.to_numpy(dtype=np.int64),
+                totals_sexes=self.totals.columns.to_numpy(dtype=str),
+                fingerprints=np.array(self.fingerprints, dtype=str),
+            )
+        os.replace(temp_path, f"{self.path}.npz")
+
+    @classmethod
+    def load(cls, path):
+        # Get the saved matrix, None if it is missing or broken
+        matrix = cls(path)
+        try:
+            with np.load(f"{path}.npz") as index:
+                matrix.keys = list(zip(index["names"].tolist(), index["sexes"].tolist()))
+                matrix.years = index["years"]
+                matrix.lengths = index["lengths"]
+                matrix.totals = pd.DataFrame(
+                    index["totals"],
+                    index=pd.Index(index["totals_years"], name="year"),
+                    columns=pd.Index(index["totals_sexes"].tolist(), name="sex"),
+                )
+                matrix.fingerprints = index["fingerprints"].tolist()
+            matrix.births = np.memmap(f"{path}.bin", dtype=np.int32, mode="r")
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+
+        matrix.offsets = np.r_[0, np.cumsum(matrix.lengths)].astype(np.int64)
+        if len(matrix.births) != matrix.offsets[-1]:
+            return None
+        matrix.index = {key: row for row, key in enumerate(matrix.keys)}
+
+        return matrix
+
+    def append_year(self, year, names_df, totals):
+        # Add rows for the names seen for the first time
+        keys = list(
+            zip(names_df["name"].astype(str).tolist(), names_df["sex"].astype(str).tolist())
         )
+        for key in keys:
+            if key not in self.index:
+                self.index[key] = len(self.keys)
+                self.keys.append(key)
+
+        # The new year block holds all known rows
+        births = np.bincount(
+            np.array([self.index[key] for key in keys], dtype=np.int64),
+            weights=names_df["birth"].to_numpy(),
+            minlength=len(self.keys),
+        ).astype(np.int32)
+
+        self.years = np.r_[self.years, year]
+        self.lengths = np.r_[self.lengths, len(births)]
+        self.offsets = np.r_[self.offsets, self.offsets[-1] + len(births)]
+        self.totals = totals
+        self.fingerprints = self.fingerprints + year_fingerprints(names_df)
+
+        if self.path is None:
+            # Copy the old years only when the buffer is full
+            start, end = self.offsets[-2], self.offsets[-1]
+            if end > len(self.buffer):
+                buffer = np.empty(max(end, 2 * len(self.buffer)), dtype=np.int32)
+                buffer[:start] = self.buffer[:start]
+                self.buffer = buffer
+            self.buffer[start:end] = births
+            self.births = self.buffer[:end]
+            return
+
+        # Append the block to the raw file and rewrite the small index only
+        with open(f"{self.path}.bin", "ab") as file:
+            births.tofile(file)
+        self.save_index()
+        self.births = np.memmap(f"{self.path}.bin", dtype=np.int32, mode="r")
+
+    def rows(self, keys):
+        # Get the row of each (name, sex) key, -1 for unknown names
+        return np.array([self.index.get(key, -1) for key in keys], dtype=np.int64)
+
+    def trajectories(self, keys):
+        # Read the births of each (name, sex) key by year, zeros for unknown names
+        keys = list(keys)
+        rows = self.rows(keys)[:, None]
+        known = (rows >= 0) & (rows < self.lengths)
+        births = np.where(known, self.births[np.where(known, self.offsets[:-1] + rows, 0)], 0)
+
+        return pd.DataFrame(
+            births,
+            index=pd.MultiIndex.from_tuples(keys, names=["name", "sex"]),
+            columns=pd.Index(self.years, name="year"),
+        )
+
+    def trajectory(self, name, sex):
+        return self.trajectories([(name, sex)]).iloc[0]
+
+    def proportions(self, keys):
+        # Divide the births by the total births of the same sex in each year
+        births = self.trajectories(keys)
+        totals = self.totals.reindex(births.columns)[births.index.get_level_values("sex")]
+
+        return births / totals.to_numpy().T
+
+    def __len__(self):
+        return len(self.keys)
 
-        # Create a table of popular girls' names by each year
-        count_girls_names = popular_girls_names.pivot_table(
-            values="birth",
-            index="name",
-            columns="year",
-            aggfunc="max",
-            dropna=True,
-            fill_value=0,
+
+class BabyNames:
+    def __init__(self, names_df, matrix_path=None):
+        # Years added with add_year() are kept as separate batches until needed
+        self.name_batches = [names_df]
+        self.matrix_path = matrix_path
+
+        # Aggregates built on demand and updated by add_year()
+        self.totals = None
+        self.ranking_batches = None
+        self.top_tables = {}
+        self.matrix = None
+
+    @property
+    def names(self):
+        # Concatenate the added years into one DataFrame
+        if len(self.name_batches) > 1:
+            names = pd.concat(self.name_batches, ignore_index=True)
+            for column in ["name", "sex"]:
+                if all(
+                    isinstance(batch[column].dtype, pd.CategoricalDtype)
+                    for batch in self.name_batches
+                ):
+                    names[column] = union_categoricals(
+                        [batch[column] for batch in self.name_batches]
+                    )
+            self.name_batches = [names]
+
+        return self.name_batches[0]
+
+    def add_year(self, year, names_df):
+        # Years are added in order, like the published yearly files
+        totals = self.total_births_count()
+        if year <= totals.index.max():
+            raise ValueError(f"Year {year} is not after the last year {totals.index.max()}")
+
+        # Add the 'year' column and cast the new year to the dtypes of the table
+        names = names_df[NAMES_COLUMNS].assign(year=year)
+        names = names.astype(
+            {
+                column: "category" if isinstance(dtype, pd.CategoricalDtype) else dtype
+                for column, dtype in self.name_batches[0].dtypes.items()
+            }
         )
 
-        # Filter a tables of popular girls' and boys' names and get most popular
-        count_boys_names = count_boys_names.loc[count_boys_names.idxmax()].drop_duplicates()
-        count_girls_names = count_girls_names.loc[count_girls_names.idxmax()].drop_duplicates()
+        # Bring the saved matrix up to date before it is extended
+        if self.matrix_path is not None:
+            self.get_matrix()
+
+        # Append the totals of the new year
+        self.totals = pd.concat([totals, count_total_births(names)])
+
+        # Append the new year to the sorted names and the top names tables
+        rows_count = sum(len(batch) for batch in self.name_batches)
+        order, offsets = rank_names(names)
+        if self.ranking_batches is not None:
+            self.ranking_batches.append((order + rows_count, offsets + rows_count))
+        for k, top in self.top_tables.items():
+            self.top_tables[k] = pd.concat(
+                [top, select_top_names(names, order, offsets, k)], ignore_index=True
+            )
+
+        # Append the new year block to the matrix
+        if self.matrix is not None:
+            self.matrix.append_year(year, names, self.totals)
+
+        self.name_batches.append(names)
+
+    def total_births_count(self):
+        # Count total births once, add_year() appends the new years
+        if self.totals is None:
+            self.totals = count_total_births(self.names)
+
+        return self.totals
+
+    def get_matrix(self):
+        # Reuse the saved matrix if the rows of every year are the same as in the table
+        if self.matrix is None:
+            totals = self.total_births_count()
+            fingerprints = year_fingerprints(self.names)
+            matrix = None
+            if self.matrix_path is not None:
+                matrix = NameYearMatrix.load(self.matrix_path)
+            if matrix is None or matrix.fingerprints != fingerprints:
+                matrix = NameYearMatrix.build(
+                    self.names, totals, self.matrix_path, fingerprints
+                )
+            self.matrix = matrix
+
+        return self.matrix
+
+    def name_trajectories(self, keys):
+        # Get the births by year of the (name, sex) keys
+        return self.get_matrix().trajectories(keys)
+
+    def name_proportions(self, keys):
+        # Get the share of the births of the same sex by year of the (name, sex) keys
+        return self.get_matrix().proportions(keys)
+
+    def get_ranking(self):
+        # Sort all names once, see rank_names(), and join the rankings of the added years
+        if self.ranking_batches is None:
+            self.ranking_batches = [rank_names(self.names)]
+        if len(self.ranking_batches) > 1:
+            orders, offsets = zip(*self.ranking_batches)
+            self.ranking_batches = [
+                (
+                    np.concatenate(orders),
+                    np.concatenate([batch[:-1] for batch in offsets] + [offsets[-1][-1:]]),
+                )
+            ]
+
+        return self.ranking_batches[0]
+
+    def top_names(self, k=1):
+        # Get the k most popular names of each year and sex
+        if k not in self.top_tables:
+            order, offsets = self.get_ranking()
+            self.top_tables[k] = select_top_names(self.names, order, offsets, k)
+
+        return self.top_tables[k]
+
+    def names_popularity_count(self):
+        # Get the most popular name of each year with minimum one name per day in year
+        top_names = self.top_names(k=1)
+        top_names = top_names[top_names["birth"] >= 365]
+
+        popularity_tables = []
+        for sex in ["M", "F"]:
+            winners = top_names[top_names["sex"] == sex]
+            years = winners["year"].to_numpy()
+            popular_names = pd.Index(pd.unique(winners["name"].astype(str)), name="name")
+
+            # Get the popular years of the most popular names only
+            names = self.names.loc[
+                (self.names["sex"] == sex)
+                & (self.names["birth"] >= 365)
+                & self.names["name"].isin(popular_names)
+            ]
+
+            # Create a table of the most popular names by each year
+            popularity = np.zeros((len(popular_names), len(years)), dtype=names["birth"].dtype)
+            np.maximum.at(
+                popularity,
+                (
+                    popular_names.get_indexer(names["name"].astype(str)),
+                    np.searchsorted(years, names["year"].to_numpy()),
+                ),
+                names["birth"].to_numpy(),
+            )
+            popularity_tables.append(
+                pd.DataFrame(
+                    popularity, index=popular_names, columns=pd.Index(years, name="year")
+                )
+            )
 
+        count_boys_names, count_girls_names = popularity_tables
         return count_boys_names, count_girls_names
 
-    def data_visualisation(self):
+    def get_diversity(self, share=0.5):
+        # Count the most popular names making up the share of births of each year and sex
+        order, offsets = self.get_ranking()
+        births = np.cumsum(self.names["birth"].to_numpy()[order], dtype=np.int64)
+
+        # Search each (year, sex) segment of the cumulative births for its share
+        starts = offsets[:-1]
+        before = np.r_[0, births][starts]
+        totals = births[offsets[1:] - 1] - before
+        positions = np.searchsorted(births, before + share * totals)
+
+        first_rows = self.names.iloc[order[starts]]
+        diversity = pd.Series(
+            positions - starts + 1,
+            index=pd.MultiIndex.from_arrays(
+                [first_rows["year"].to_numpy(), first_rows["sex"].astype(str).to_numpy()],
+                names=["year", "sex"],
+            ),
+        )
+        return diversity.unstack("sex")
+
+    def last_letter_count(self, normalize=False):
+        # Get the integer codes of the name last letters, years and sexes
+        name = self.names["name"].astype("category")
+        sex = self.names["sex"].astype("category")
+        letter_codes, letters = pd.factorize(name.cat.categories.str[-1], sort=True)
+        letter_codes = letter_codes[name.cat.codes.to_numpy()]
+        years, year_codes = np.unique(self.names["year"].to_numpy(), return_inverse=True)
+        sex_codes = sex.cat.codes.to_numpy()
+
+        # Count births in a (last letter, sex, year) cube in one pass
+        shape = (len(letters), len(sex.cat.categories), len(years))
+        cube = np.bincount(
+            np.ravel_multi_index((letter_codes, sex_codes, year_codes), shape),
+            weights=self.names["birth"].to_numpy(),
+            minlength=np.prod(shape),
+        ).reshape(shape[0], -1)
+
+        letters_table = pd.DataFrame(
+            cube.astype(np.int64),
+            index=pd.Index(letters, name="last_letter"),
+            columns=pd.MultiIndex.from_product(
+                [sex.cat.categories.astype(str), years], names=["sex", "year"]
+            ),
+        )
+
+        # Get the share of each last letter in the births of a year and sex
+        if normalize:
+            letters_table = letters_table / letters_table.sum()
+
+        return letters_table
+
+    def data_visualisation(self, plot_years=range(1880, 2011, 10)):
         fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(13, 10))
 
+        # Keep only the plotted years (every 10 years by default)
+        plot_names = BabyNames(names_df=self.names[self.names["year"].isin(plot_years)])
+
         # Plotting total births (ax1)
-        total_data = self.total_births_count()
+        total_data = plot_names.total_births_count()
 
         # Rearrange data for plotting
         total_data = total_data.stack()
@@ -94,7 +630,7 @@ class BabyNames:
 
         # Plotting most popular names per each day (ax2, ax3)
         # Get the handled data from names_popularity_count()
-        boys_names_data, girls_names_data = self.names_popularity_count()
+        boys_names_data, girls_names_data = plot_names.names_popularity_count()
 
         # Get the number of most popular boys and girls names by each day in year
         boys_names_data = boys_names_data / 365
@@ -221,21 +757,21 @@ class BabyNames:
 
 if __name__ == "__main__":
     try:
-        # Get all data from datasets/babynames folder in one DataFrame
-        # Create a list of DataFrames for each year
-        pieces = [
-            pd.read_csv(
-                f"../datasets/babynames/yob{year}.txt",
-                names=["name", "sex", "birth"],  # Add columns to DataFrame
-            ).assign(year=year)  # Add the 'year' column to DataFrame
-            for year in range(1880, 2011, 10)  # Loop over each 10 years from 1880 to 2011
-        ]
-
-        # Collect all data in one DataFrame
-        names = pd.concat(pieces, ignore_index=True)
+        # Get all data from datasets/babynames folder in one DataFrame,
+        # the consolidated store is reused on the next runs
+        names = load_babynames(
+            "../datasets/babynames",
+            years=range(1880, 2011),
+            store_path="../datasets/babynames/babynames.cache.npz",
+        )
 
-        babynames = BabyNames(names_df=names)
+        babynames = BabyNames(
+            names_df=names, matrix_path="../datasets/babynames/babynames_matrix.cache"
+        )
         # print(babynames.__repr__())
+        # print(babynames.name_trajectories([("Mary", "F"), ("John", "M")]))
+        # print(babynames.get_diversity())
+        # print(babynames.last_letter_count(normalize=True))
         babynames.data_visualisation()
 
     except FileNotFoundError as err:
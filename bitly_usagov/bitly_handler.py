@@ -1,4 +1,13 @@
+from array import array
+import asyncio
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import heapq
 import json
+import os
+import sys
+import time
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -15,61 +24,748 @@ plt.rc("figure", figsize=(13, 8))
 pd.set_option("display.max_rows", 100)
 
 
+class CategoryBuffer:
+    def __init__(self):
+        # Dictionary encoded column: a code per row and each distinct value once.
+        self.codes = array("i")
+        self.index = {}
+
+    def append(self, value):
+        # Missing values get code -1.
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def to_array(self):
+        return pd.Categorical.from_codes(
+            np.frombuffer(self.codes, dtype=np.int32), categories=list(self.index)
+        )
+
+
+class NumberBuffer:
+    def __init__(self):
+        # Numeric column of 8-byte floats, a value per row, missing values are NaN.
+        self.values = array("d")
+
+    def append(self, value):
+        self.values.append(value if isinstance(value, (int, float)) else np.nan)
+
+    def to_array(self):
+        return np.frombuffer(self.values, dtype=np.float64)
+
+
+# Column buffer types for the projected record fields.
+COLUMN_BUFFERS = {"category": CategoryBuffer, "number": NumberBuffer}
+
+
+def parse_json_line(line):
+    # Get a record from the line, or None for a malformed line.
+    try:
+        rec = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+
+    return rec if isinstance(rec, dict) else None
+
+
+def iter_json_lines(path):
+    # Read the file lazily and yield a record per line, or None for a malformed line.
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield parse_json_line(line)
+
+
+async def tail_json_lines(path, poll_interval=1.0, from_start=True):
+    # Follow a growing file and yield its new records, or None for malformed lines.
+    with open(path) as file:
+        if not from_start:
+            file.seek(0, os.SEEK_END)
+
+        pending = ""
+        while True:
+            line = file.readline()
+            if not line:
+                # Wait for new data without blocking the event loop.
+                await asyncio.sleep(poll_interval)
+                continue
+
+            # Keep a partly written line until its end is written.
+            pending += line
+            if not pending.endswith("\n"):
+                continue
+            line, pending = pending, ""
+            if line.strip():
+                yield parse_json_line(line)
+
+
+def field_value(value):
+    # Nested values are kept as JSON text, so every field value is hashable.
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def read_json_lines(path, fields):
+    # Count each distinct combination of the requested fields, so memory grows with
+    # the number of distinct combinations instead of the number of records.
+    columns = {name: COLUMN_BUFFERS[kind]() for name, kind in fields.items()}
+    rows = {}
+    counts = array("q")
+    malformed_lines = 0
+
+    for rec in iter_json_lines(path):
+        # Count lines which are not valid JSON objects and skip them.
+        if rec is None:
+            malformed_lines += 1
+            continue
+        key = tuple(field_value(rec.get(name)) for name in columns)
+        row = rows.get(key)
+        if row is None:
+            # Add a row for the new combination of field values.
+            row = rows[key] = len(counts)
+            counts.append(0)
+            for column, value in zip(columns.values(), key):
+                column.append(value)
+        counts[row] += 1
+
+    return columns, np.frombuffer(counts, dtype=np.int64), malformed_lines
+
+
+# Substring rules for user agent families, checked in order.
+OS_FAMILIES = [
+    ("Windows", "Windows"),
+    ("iPhone", "iOS"),
+    ("iPad", "iOS"),
+    ("iPod", "iOS"),
+    ("Android", "Android"),
+    ("BlackBerry", "BlackBerry"),
+    ("Macintosh", "Mac OS X"),
+    ("Mac OS X", "Mac OS X"),
+    ("CrOS", "Chrome OS"),
+    ("Linux", "Linux"),
+    ("X11", "Unix"),
+]
+BROWSER_FAMILIES = [
+    ("Edge", "Edge"),
+    ("OPR", "Opera"),
+    ("Opera", "Opera"),
+    ("CriOS", "Chrome"),
+    ("Chrome", "Chrome"),
+    ("Firefox", "Firefox"),
+    ("MSIE", "Internet Explorer"),
+    ("Trident", "Internet Explorer"),
+    ("Safari", "Safari"),
+]
+DEVICE_FAMILIES = [
+    ("bot", "Bot"),
+    ("spider", "Bot"),
+    ("crawl", "Bot"),
+    ("ipad", "Tablet"),
+    ("tablet", "Tablet"),
+    ("mobile", "Mobile"),
+    ("iphone", "Mobile"),
+    ("android", "Mobile"),
+    ("blackberry", "Mobile"),
+]
+
+
+def match_family(agent, rules, default="Other"):
+    # Return the family of the first rule found in the user agent string.
+    return next((family for token, family in rules if token in agent), default)
+
+
+class UserAgentClassifier:
+    def __init__(self, cache_path=None, maxsize=10000):
+        # Bounded LRU cache of parsed user agents, optionally kept in a JSON file.
+        self.cache_path = cache_path
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        if cache_path is not None and os.path.exists(cache_path):
+            # A broken cache file is ignored and overwritten by the next save().
+            try:
+                with open(cache_path) as file:
+                    entries = json.load(file)
+                # Keep only the most recently used agents of the cache file.
+                for agent, families in entries[len(entries) - maxsize :]:
+                    self.cache[agent] = tuple(families)
+            except (OSError, ValueError, TypeError):
+                self.cache.clear()
+
+    def classify(self, agent):
+        # Parse the user agent into (os, browser, device) families once.
+        families = self.cache.get(agent)
+        if families is not None:
+            self.cache.move_to_end(agent)
+            return families
+
+        families = (
+            match_family(agent, OS_FAMILIES),
+            match_family(agent, BROWSER_FAMILIES),
+            match_family(agent.lower(), DEVICE_FAMILIES, default="Desktop"),
+        )
+        self.cache[agent] = families
+        # Evict the least recently used user agent.
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+        return families
+
+    def update(self, cache):
+        # Add the agents parsed by another classifier, e.g. in a worker process.
+        for agent, families in cache.items():
+            self.cache[agent] = families
+            self.cache.move_to_end(agent)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def save(self):
+        # Keep the cache for the next runs, in least recently used order.
+        # Write a temporary file and move it into place, so an interrupted save
+        # never leaves a truncated cache file.
+        if self.cache_path is not None:
+            temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as file:
+                json.dump(list(self.cache.items()), file)
+            os.replace(temp_path, self.cache_path)
+
+
+def record_tz_os(rec, classifier):
+    # Get time zone and 'Windows' or 'Not Windows' label of the record.
+    tz = rec.get("tz")
+    if tz is None or rec.get("a") is None:
+        return tz, None
+    os_family = classifier.classify(rec["a"])[0]
+
+    return tz, "Windows" if os_family == "Windows" else "Not Windows"
+
+
+class TimeZoneCounts:
+    def __init__(self):
+        # Mergeable counters of time zones and of time zones by operating system.
+        self.tz = Counter()
+        self.tz_os = Counter()
+        self.malformed_lines = 0
+
+    def add(self, tz, os_name):
+        # Count record with a time zone, and with a user agent if present.
+        self.tz[tz] += 1
+        if os_name is not None:
+            self.tz_os[tz, os_name] += 1
+
+    def remove(self, tz, os_name):
+        # Uncount record, counters which drop to zero are deleted.
+        self.tz[tz] -= 1
+        if not self.tz[tz]:
+            del self.tz[tz]
+        if os_name is not None:
+            self.tz_os[tz, os_name] -= 1
+            if not self.tz_os[tz, os_name]:
+                del self.tz_os[tz, os_name]
+
+    def merge(self, other):
+        # Add counters of another shard.
+        self.tz.update(other.tz)
+        self.tz_os.update(other.tz_os)
+        self.malformed_lines += other.malformed_lines
+
+    def time_zone_count(self, n=10):
+        # Get the most common time zones without empty time zones.
+        tz_counts = pd.Series(self.tz, dtype=np.int64).rename_axis("tz")
+        tz_counts = tz_counts.sort_values(ascending=False, kind="stable")
+
+        return tz_counts.drop("", errors="ignore").head(n)
+
+    def tz_os_table(self):
+        # Create time zones by operating system table without empty time zones.
+        agg_counts = pd.Series(
+            list(self.tz_os.values()),
+            index=pd.MultiIndex.from_tuples(list(self.tz_os), names=["tz", "os"]),
+            dtype=np.int64,
+        )
+
+        return agg_counts.unstack(fill_value=0).drop("", errors="ignore")
+
+
+class SpaceSaving:
+    def __init__(self, capacity=100):
+        # Space-Saving summary: at most 'capacity' counters with their overestimation.
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, item), entries with outdated counts are skipped.
+        self.heap = []
+
+    def pop_min(self):
+        # Remove the item with the smallest count.
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                del self.counts[item]
+                return count, self.errors.pop(item)
+
+    def update(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        else:
+            # Replace the smallest counter, its count bounds the new item's error.
+            error = self.pop_min()[0] if len(self.counts) >= self.capacity else 0
+            self.counts[item] = error + count
+            self.errors[item] = error
+        heapq.heappush(self.heap, (self.counts[item], item))
+
+        # Drop the outdated heap entries to keep memory fixed.
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def min_count(self):
+        # Upper bound of the count of any item which is not monitored.
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other):
+        # Sum the counts, an item missing in one summary may have up to its minimum.
+        self_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            merged[item] = (
+                self.counts.get(item, self_min) + other.counts.get(item, other_min),
+                self.errors.get(item, self_min) + other.errors.get(item, other_min),
+            )
+
+        # Keep the largest counters.
+        top = heapq.nlargest(self.capacity, merged.items(), key=lambda x: x[1][0])
+        self.counts = {item: count for item, (count, _) in top}
+        self.errors = {item: error for item, (_, error) in top}
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, n):
+        # Get n items with the largest counts as (item, count, error).
+        items = heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    def to_dict(self):
+        return {
+            "capacity": self.capacity,
+            "items": [
+                [item, self.counts[item], self.errors[item]] for item in self.counts
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        summary = cls(state["capacity"])
+        for item, count, error in state["items"]:
+            # JSON stores tuple items as lists.
+            item = tuple(item) if isinstance(item, list) else item
+            summary.counts[item] = count
+            summary.errors[item] = error
+            summary.heap.append((count, item))
+        heapq.heapify(summary.heap)
+
+        return summary
+
+
+class HeavyHitterCounts:
+    def __init__(self, capacity=1000):
+        # Approximate counters in fixed memory, with the TimeZoneCounts interface.
+        self.tz = SpaceSaving(capacity)
+        self.tz_os = SpaceSaving(2 * capacity)
+        self.malformed_lines = 0
+
+    def add(self, tz, os_name):
+        # Empty time zones are never reported, so they don't use the counters.
+        if tz == "":
+            return
+        self.tz.update(tz)
+        if os_name is not None:
+            self.tz_os.update((tz, os_name))
+
+    def merge(self, other):
+        self.tz.merge(other.tz)
+        self.tz_os.merge(other.tz_os)
+        self.malformed_lines += other.malformed_lines
+
+    def time_zone_bounds(self, n=10):
+        # Get the most common time zones with their count error bounds.
+        bounds = pd.DataFrame(
+            self.tz.top(n), columns=["tz", "count", "error"]
+        ).set_index("tz")
+        bounds["lower_bound"] = bounds["count"] - bounds["error"]
+
+        return bounds
+
+    def time_zone_count(self, n=10):
+        return self.time_zone_bounds(n)["count"]
+
+    def tz_os_table(self):
+        # Create time zones by operating system table from the monitored pairs.
+        top = self.tz_os.top(self.tz_os.capacity)
+        agg_counts = pd.Series(
+            [count for _, count, _ in top],
+            index=pd.MultiIndex.from_tuples(
+                [item for item, _, _ in top], names=["tz", "os"]
+            ),
+            dtype=np.int64,
+        )
+
+        return agg_counts.unstack(fill_value=0)
+
+    def save(self, path):
+        # Checkpoint the counters to a JSON file.
+        with open(path, "w") as file:
+            json.dump(
+                {
+                    "tz": self.tz.to_dict(),
+                    "tz_os": self.tz_os.to_dict(),
+                    "malformed_lines": self.malformed_lines,
+                },
+                file,
+            )
+
+    @classmethod
+    def load(cls, path):
+        # Restore the counters from a checkpoint file.
+        with open(path) as file:
+            state = json.load(file)
+        counts = cls()
+        counts.tz = SpaceSaving.from_dict(state["tz"])
+        counts.tz_os = SpaceSaving.from_dict(state["tz_os"])
+        counts.malformed_lines = state["malformed_lines"]
+
+        return counts
+
+
+def count_records(records, counts, classifier=None):
+    # Count the records stream, None records are malformed lines.
+    classifier = UserAgentClassifier() if classifier is None else classifier
+    for rec in records:
+        if rec is None:
+            counts.malformed_lines += 1
+            continue
+        tz, os_name = record_tz_os(rec, classifier)
+        if tz is not None:
+            counts.add(tz, os_name)
+
+    return counts
+
+
+def count_log_file(path, capacity=None, classifier=None):
+    # Count one log file, exactly or approximately in fixed memory if capacity is set.
+    counts = TimeZoneCounts() if capacity is None else HeavyHitterCounts(capacity)
+
+    return count_records(iter_json_lines(path), counts, classifier)
+
+
+def count_log_file_agents(path, capacity, classifier):
+    # Count one log file in a worker process and return its parsed user agents too.
+    counts = count_log_file(path, capacity, classifier)
+
+    return counts, classifier.cache
+
+
+def count_log_files(paths, processes=None, capacity=None, classifier=None):
+    # Count the files in a process pool and merge the partial counters.
+    counts = TimeZoneCounts() if capacity is None else HeavyHitterCounts(capacity)
+    classifier = UserAgentClassifier() if classifier is None else classifier
+
+    # A single file is counted in this process, without starting a pool.
+    if len(paths) == 1:
+        counts = count_log_file(paths[0], capacity, classifier)
+        classifier.save()
+        return counts
+
+    with ProcessPoolExecutor(processes) as executor:
+        for partial, agents in executor.map(
+            functools.partial(
+                count_log_file_agents, capacity=capacity, classifier=classifier
+            ),
+            paths,
+        ):
+            counts.merge(partial)
+            # Keep the user agents parsed by the workers for the next runs.
+            classifier.update(agents)
+    classifier.save()
+
+    return counts
+
+
+def benchmark_heavy_hitters(path, scale=100, capacity=100):
+    # Compare exact and approximate counting on the log file repeated 'scale' times.
+    def stream():
+        for _ in range(scale):
+            yield from iter_json_lines(path)
+
+    results = {}
+    for name, counts in [
+        ("exact", TimeZoneCounts()),
+        ("approximate", HeavyHitterCounts(capacity)),
+    ]:
+        start = time.perf_counter()
+        count_records(stream(), counts)
+        results[name] = (time.perf_counter() - start, counts.time_zone_count(10))
+
+    # Get top 10 recall and the largest relative count error.
+    exact, approximate = results["exact"][1], results["approximate"][1]
+    recall = len(exact.index.intersection(approximate.index)) / len(exact)
+    error = (approximate / exact).dropna().sub(1).abs().max()
+
+    print(f"Records: {scale * sum(1 for _ in iter_json_lines(path))}")
+    print(f"Exact time: {results['exact'][0]:.3f} s")
+    print(f"Approximate time: {results['approximate'][0]:.3f} s")
+    print(f"Top 10 recall: {recall:.2f}, max relative error: {error:.4f}")
+
+
+def tz_os_shares(agg_counts, n=10):
+    # Dense time zones by operating system count matrix and its row totals.
+    counts = agg_counts.to_numpy()
+    totals = counts.sum(axis=1)
+
+    # Select n largest totals in linear time, ties keep the table order like nlargest().
+    k = min(n, len(totals))
+    if k:
+        kth = np.partition(totals, len(totals) - k)[len(totals) - k]
+        above = np.flatnonzero(totals > kth)
+        ties = np.flatnonzero(totals == kth)[: k - len(above)]
+        top = np.concatenate([above, ties])
+        top = top[np.lexsort((top, -totals[top]))]
+    else:
+        top = np.arange(0)
+
+    # Rearrange data for plotting, one row per time zone and operating system.
+    n_os = counts.shape[1]
+    count_subset = pd.DataFrame(
+        {
+            "tz": np.repeat(agg_counts.index.to_numpy()[top], n_os),
+            "os": np.tile(agg_counts.columns.to_numpy(), len(top)),
+            "total": counts[top].reshape(-1),
+        }
+    )
+
+    # Calculate normalized total within each time zone.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = counts[top] / totals[top, np.newaxis]
+    results = count_subset.assign(normed_total=shares.reshape(-1))
+
+    return count_subset, results
+
+
+class SlidingWindowCounts:
+    def __init__(self, window, clock=time.monotonic):
+        # Counts of the records added during the last 'window' seconds.
+        self.window = window
+        self.clock = clock
+        self.events = deque()
+        self.counts = TimeZoneCounts()
+
+    def expire(self, now=None):
+        # Uncount records older than the window, each record is removed only once.
+        now = self.clock() if now is None else now
+        while self.events and self.events[0][0] <= now - self.window:
+            _, tz, os_name = self.events.popleft()
+            self.counts.remove(tz, os_name)
+
+    def add(self, tz, os_name, now=None):
+        now = self.clock() if now is None else now
+        self.expire(now)
+        self.events.append((now, tz, os_name))
+        self.counts.add(tz, os_name)
+
+    def time_zone_count(self, n=10):
+        self.expire()
+        return self.counts.time_zone_count(n)
+
+    def users_browser_count(self, n=10):
+        self.expire()
+        return tz_os_shares(self.counts.tz_os_table(), n)
+
+
+class BitlyLiveTail:
+    def __init__(
+        self, path, windows=(300, 3600), poll_interval=1.0, clock=time.monotonic
+    ):
+        # Sliding window counts of a growing log file, keyed by window seconds.
+        self.path = path
+        self.poll_interval = poll_interval
+        self.windows = {
+            window: SlidingWindowCounts(window, clock) for window in windows
+        }
+        self.classifier = UserAgentClassifier()
+        self.malformed_lines = 0
+
+    async def run(self, from_start=True):
+        # Count new records as they are written, until the task is cancelled.
+        async for rec in tail_json_lines(self.path, self.poll_interval, from_start):
+            if rec is None:
+                self.malformed_lines += 1
+                continue
+            tz, os_name = record_tz_os(rec, self.classifier)
+            if tz is not None:
+                for counts in self.windows.values():
+                    counts.add(tz, os_name)
+
+    def time_zone_count(self, window=300, n=10):
+        return self.windows[window].time_zone_count(n)
+
+    def users_browser_count(self, window=300, n=10):
+        return self.windows[window].users_browser_count(n)
+
+
 class BitlyUsaGov:
-    def __init__(self, path):
-        # Get data from file.
-        self.records = [json.loads(line) for line in open(path)]
-        # Get all time zones from data.
-        self.time_zones = [rec["tz"] for rec in self.records if "tz" in rec]
+    def __init__(
+        self,
+        path,
+        streaming=False,
+        fields=None,
+        ua_cache_path=None,
+        processes=None,
+        capacity=None,
+    ):
+        # User agent classifier with a persistent cache of parsed agents.
+        self.ua_classifier = UserAgentClassifier(ua_cache_path)
 
-    def time_zone_count(self):
-        # Count time zones in dateset.
-        df = pd.DataFrame(self.records)
+        # Counters of many log files, see count_log_files().
+        self.counts = None
 
-        # Clean data.
-        clean_tz = df["tz"].dropna()
-        clean_tz = clean_tz[clean_tz != ""]
-        tz_counts = clean_tz.value_counts()
+        if isinstance(path, (list, tuple)) or capacity is not None:
+            # Count log files in parallel without keeping the records,
+            # approximately in fixed memory if capacity is set.
+            paths = [path] if isinstance(path, str) else path
+            self.records = None
+            self.counts = count_log_files(
+                paths, processes, capacity, self.ua_classifier
+            )
+            self.malformed_lines = self.counts.malformed_lines
+            self.time_zones = None
+        elif streaming:
+            # Count the distinct combinations of the needed fields without keeping
+            # the records, see read_json_lines().
+            self.records = None
+            self.fields = {"tz": "category", "a": "category", **(fields or {})}
+            self.columns, self.row_counts, self.malformed_lines = read_json_lines(
+                path, self.fields
+            )
+            self.time_zones = None
+        else:
+            # Get data from file.
+            with open(path) as file:
+                self.records = [json.loads(line) for line in file]
+            # Get all time zones from data.
+            self.time_zones = [rec["tz"] for rec in self.records if "tz" in rec]
 
-        return tz_counts.head(10)
+        # Projected frame shared by the analysis methods, see get_frame().
+        self.frame = None
 
-    def users_browser_count(self):
-        df = pd.DataFrame(self.records)
+    def get_frame(self):
+        # The records are not kept when many log files are counted.
+        if self.counts is not None:
+            raise ValueError(
+                "Records are not kept in the multi-file and capacity modes"
+            )
+
+        # Build the projected frame once and share it between all analysis methods.
+        if self.frame is None:
+            # The 'count' column holds the number of records of each row.
+            if self.records is not None:
+                frame = pd.DataFrame(self.records, columns=["tz", "a"])
+                frame = frame.astype({"tz": "category", "a": "category"})
+                frame["count"] = np.ones(len(frame), dtype=np.int64)
+            else:
+                frame = pd.DataFrame(
+                    {name: column.to_array() for name, column in self.columns.items()}
+                )
+                frame["count"] = self.row_counts
+
+            # Classify each distinct user agent once and broadcast by codes.
+            agent_codes = frame["a"].cat.codes.to_numpy()
+            families = [
+                self.ua_classifier.classify(agent)
+                for agent in frame["a"].cat.categories
+            ]
+            self.ua_classifier.save()
+            # Without any user agent the family columns are all missing.
+            columns = ["os_family", "browser", "device"]
+            values_by_column = zip(*families) if families else [()] * len(columns)
+            for column, values in zip(columns, values_by_column):
+                codes, categories = pd.factorize(pd.Series(values, dtype=object))
+                # Code -1 of a missing user agent picks the appended -1 code.
+                frame[column] = pd.Categorical.from_codes(
+                    np.append(codes, -1)[agent_codes], categories
+                )
+
+            # Split users to Windows and other users.
+            frame["os"] = pd.Categorical.from_codes(
+                np.where(
+                    frame["os_family"].isna(),
+                    -1,
+                    frame["os_family"] == "Windows",
+                ),
+                categories=["Not Windows", "Windows"],
+            )
+            self.frame = frame
 
-        # Remove rows with an empty 'tz' column values.
-        df = df[df["tz"] != ""]
+        return self.frame
 
-        # Get 'Windows' browser users.
-        cframe = df[df.a.notnull()]
-        cframe = cframe.copy()
-        cframe["os"] = np.where(
-            cframe["a"].str.contains("Windows"), "Windows", "Not Windows"
+    def time_zone_count(self):
+        if self.counts is not None:
+            # Get time zones counts of many log files.
+            return self.counts.time_zone_count(10)
+
+        # Count time zones in dateset using categorical codes.
+        df = self.get_frame()
+        tz_codes = df["tz"].cat.codes.to_numpy()
+        keep = tz_codes >= 0
+        tz_counts = pd.Series(
+            np.bincount(
+                tz_codes[keep],
+                weights=df["count"].to_numpy()[keep],
+                minlength=len(df["tz"].cat.categories),
+            ).astype(np.int64),
+            index=pd.Index(df["tz"].cat.categories, name="tz"),
+            name="count",
         )
+        tz_counts = tz_counts[tz_counts > 0].sort_values(ascending=False, kind="stable")
 
-        # Group DataFrame by time zones.
-        by_tz_os = cframe.groupby(["tz", "os"])
+        # Clean data.
+        tz_counts = tz_counts.drop("", errors="ignore")
 
-        # Create table.
-        agg_counts = by_tz_os.size().unstack().fillna(0)
+        return tz_counts.head(10)
 
-        # Compute 'total' column.
-        agg_counts["total"] = agg_counts.sum(axis=1)
+    def users_browser_count(self):
+        if self.counts is not None:
+            # Get table of many log files counts.
+            return tz_os_shares(self.counts.tz_os_table())
 
-        # Get 10 largest amount using nlargest() and keep as DataFrame.
-        count_subset = agg_counts.nlargest(10, "total")
+        df = self.get_frame()
+        tz_codes = df["tz"].cat.codes.to_numpy()
+        os_codes = df["os"].cat.codes.to_numpy()
+        tz_names = df["tz"].cat.categories
+        os_names = df["os"].cat.categories
 
-        # Rearrange data for plotting.
-        count_subset = count_subset.stack()
-        count_subset.name = "total"
-        count_subset = count_subset.reset_index()
-        # Remove from table 'total' rows.
-        count_subset = count_subset[count_subset["os"] != "total"]
+        # Remove rows with an empty 'tz' column values and unknown browser.
+        keep = (tz_codes >= 0) & (os_codes >= 0)
+        if "" in tz_names:
+            keep &= tz_codes != tz_names.get_loc("")
 
-        # Calculate normalized total within each time zone.
-        results = count_subset.groupby("tz").apply(
-            lambda x: x.assign(normed_total=x.total / x.total.sum())
+        # Create time zones by operating system table from the codes.
+        cells = tz_codes[keep].astype(np.int64) * len(os_names) + os_codes[keep]
+        agg_counts = pd.DataFrame(
+            np.bincount(
+                cells,
+                weights=df["count"].to_numpy()[keep],
+                minlength=len(tz_names) * len(os_names),
+            )
+            .astype(np.int64)
+            .reshape(len(tz_names), len(os_names)),
+            index=pd.Index(tz_names, name="tz"),
+            columns=pd.Index(os_names, name="os"),
         )
-        return count_subset, results
+        agg_counts = agg_counts[agg_counts.sum(axis=1) > 0]
+
+        return tz_os_shares(agg_counts)
 
     def data_visualisation(self):
         # Create a single figure with three subplots stacked vertically.
@@ -101,9 +797,18 @@ class BitlyUsaGov:
 
 if __name__ == "__main__":
     try:
+        if "--benchmark" in sys.argv:
+            # Compare exact and approximate time zones counting on scaled up data.
+            benchmark_heavy_hitters(
+                path="../datasets/bitly/example.txt", scale=100, capacity=30
+            )
+            sys.exit()
+
         usagov = BitlyUsaGov(
             # Path to dataset file.
-            path="../datasets/bitly/example.txt"
+            path="../datasets/bitly/example.txt",
+            # Path to parsed user agents cache file.
+            ua_cache_path="../datasets/bitly/example.ua_cache.json",
         )
         usagov.time_zone_count()
         usagov.users_browser_count()
@@ -0,0 +1,54 @@
+from bitly_handler import BitlyLiveTail
+
+
+WINDOW = 60
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_live_tail(clock):
+    return BitlyLiveTail(path=None, windows=(WINDOW,), clock=clock)
+
+
+def assert_empty_window(live_tail):
+    count_subset, results = live_tail.users_browser_count(WINDOW)
+    assert live_tail.time_zone_count(WINDOW).empty
+    assert count_subset.empty
+    assert results.empty
+    assert list(count_subset.columns) == ["tz", "os", "total"]
+    assert list(results.columns) == ["tz", "os", "total", "normed_total"]
+
+
+def test_empty_window_before_first_record():
+    live_tail = make_live_tail(FakeClock())
+
+    assert_empty_window(live_tail)
+
+
+def test_window_counts_records():
+    live_tail = make_live_tail(FakeClock())
+    live_tail.windows[WINDOW].add("America/New_York", "Windows")
+    live_tail.windows[WINDOW].add("America/New_York", None)
+
+    assert live_tail.time_zone_count(WINDOW)["America/New_York"] == 2
+    count_subset, results = live_tail.users_browser_count(WINDOW)
+    assert count_subset["total"].sum() == 1
+    assert results["normed_total"].sum() == 1
+
+
+def test_expired_window_is_empty():
+    clock = FakeClock()
+    live_tail = make_live_tail(clock)
+    live_tail.windows[WINDOW].add("America/New_York", "Windows")
+    live_tail.windows[WINDOW].add("Europe/London", "Not Windows")
+
+    # All records expire one window later
+    clock.now += WINDOW
+
+    assert_empty_window(live_tail)
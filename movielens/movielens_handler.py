@@ -1,4 +1,13 @@
+from collections import OrderedDict
+import copy
+import csv
+import io
+import itertools
+import os
+import zipfile
+
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
@@ -8,81 +17,517 @@ pd.set_option("display.width", None)
 pd.set_option("display.max_colwidth", None)
 
 
-class MovieLens:
-    def __init__(self, users_file, movies_file, ratings_file):
-        # Create DataFrame from the users table
-        self.users = pd.read_table(
-            users_file,
-            sep="::",
-            header=None,
-            names=["user_id", "gender", "age", "occupation", "zip"],
-            engine="python",
+# Columns of the MovieLens tables and their compact dtypes
+USERS_COLUMNS = {
+    "user_id": "int32",
+    "gender": "category",
+    "age": "int8",
+    "occupation": "int8",
+    "zip": "category",
+}
+MOVIES_COLUMNS = {"movie_id": "int32", "title": "object", "genres": "object"}
+RATINGS_COLUMNS = {
+    "user_id": "int32",
+    "movie_id": "int32",
+    "rating": "int8",
+    "timestamp": "int64",
+}
+
+
+def parse_dat_content(content, columns):
+    # Replace the two-character '::' separator with a tab to use the fast C parser
+    return pd.read_csv(
+        io.BytesIO(content.replace(b"::", b"\t")),
+        sep="\t",
+        header=None,
+        names=list(columns),
+        dtype=columns,
+        quoting=csv.QUOTE_NONE,
+        engine="c",
+    )
+
+
+def parse_dat_table(path, columns):
+    with open(path, "rb") as file:
+        return parse_dat_content(file.read(), columns)
+
+
+def iter_dat_chunks(path, columns, chunksize):
+    # Parse the table by blocks of at most chunksize lines
+    with open(path, "rb") as file:
+        while lines := list(itertools.islice(file, chunksize)):
+            yield parse_dat_content(b"".join(lines), columns)
+
+
+def load_cached_table(path, columns):
+    # Return None when the cache is missing, broken or the source file was changed
+    stat = os.stat(path)
+    try:
+        with np.load(f"{path}.cache.npz") as cache:
+            if cache["source_stat"].tolist() != [stat.st_mtime_ns, stat.st_size]:
+                return None
+
+            table = {}
+            for name, dtype in columns.items():
+                if dtype == "category":
+                    table[name] = pd.Categorical.from_codes(
+                        cache[f"{name}.codes"],
+                        cache[f"{name}.categories"].astype(object),
+                    )
+                elif dtype == "object":
+                    table[name] = cache[name].astype(object)
+                else:
+                    table[name] = cache[name]
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+    return pd.DataFrame(table)
+
+
+def save_cached_table(path, table):
+    # Store every column as a plain NumPy array together with the source file stat
+    stat = os.stat(path)
+    arrays = {"source_stat": np.array([stat.st_mtime_ns, stat.st_size])}
+    for name, column in table.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            arrays[f"{name}.codes"] = column.cat.codes.to_numpy()
+            arrays[f"{name}.categories"] = column.cat.categories.to_numpy(dtype=str)
+        elif column.dtype == object:
+            arrays[name] = column.to_numpy(dtype=str)
+        else:
+            arrays[name] = column.to_numpy()
+
+    # Write a temporary file and move it into place, so an interrupted save never
+    # leaves a truncated cache, skip caching silently if the folder is read-only
+    temp_path = f"{path}.cache.npz.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, f"{path}.cache.npz")
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_dat_table(path, columns, use_cache=True):
+    # Reuse the binary columnar cache while the source file is unchanged
+    table = load_cached_table(path, columns) if use_cache else None
+    if table is None:
+        table = parse_dat_table(path, columns)
+        if use_cache:
+            save_cached_table(path, table)
+
+    return table
+
+
+def lookup_codes(table, ids):
+    # Map ids to dimension codes, ids missing from the lookup table get -1
+    ids = np.asarray(ids, dtype=np.int64)
+    known = (ids >= 0) & (ids < len(table))
+    return np.where(known, table[np.where(known, ids, 0)], -1)
+
+
+class RatingsEngine:
+    def __init__(self, users, movies):
+        # Code titles in sorted order so results match pivot_table() output
+        title_codes, self.titles = pd.factorize(movies["title"], sort=True)
+        self.titles = pd.Index(self.titles, name="title")
+        self.release_years = (
+            self.titles.str.extract(r"\((\d{4})\)")[0].fillna(-1).astype(int).to_numpy()
         )
 
-        # Create DataFrame from the movies table
-        self.movies = pd.read_table(
-            movies_file,
-            sep="::",
-            header=None,
-            names=["movie_id", "title", "genres"],
-            engine="python",
+        # Release-year index: titles sorted by year and offsets of each year
+        self.year_order = np.argsort(self.release_years, kind="stable")
+        self.first_year = self.release_years.min()
+        self.year_offsets = np.searchsorted(
+            self.release_years[self.year_order],
+            np.arange(self.first_year, self.release_years.max() + 2),
         )
 
-        # Create DataFrame from the ratings table
-        self.ratings = pd.read_table(
-            ratings_file,
-            sep="::",
-            header=None,
-            names=["user_id", "movie_id", "rating", "timestamp"],
-            engine="python",
+        # Sparse title x genre indicator matrix in coordinate form, built from the
+        # pipe-separated genres of each title once
+        title_genres = pd.Series(movies["genres"].to_numpy(), index=title_codes)
+        title_genres = title_genres[~title_genres.index.duplicated()]
+        title_genres = title_genres.str.split("|").explode().dropna()
+        self.genre_codes, self.genres = pd.factorize(title_genres, sort=True)
+        self.genres = pd.Index(self.genres, name="genre")
+        self.genre_titles = title_genres.index.to_numpy()
+
+        # Code users' gender and age
+        gender_codes, self.genders = pd.factorize(users["gender"], sort=True)
+        self.genders = pd.Index(self.genders, name="gender")
+        age_codes, self.age_groups = pd.factorize(users["age"], sort=True)
+        self.age_groups = pd.Index(self.age_groups, name="age")
+        self.ages = np.asarray(self.age_groups, dtype=np.float64)
+
+        # Build id -> code lookup arrays for the movie and user dimensions
+        self.movie_title = np.full(movies["movie_id"].max() + 1, -1, dtype=np.int64)
+        self.movie_title[movies["movie_id"].to_numpy()] = title_codes
+        self.user_gender = np.full(users["user_id"].max() + 1, -1, dtype=np.int64)
+        self.user_gender[users["user_id"].to_numpy()] = gender_codes
+        self.user_age = np.full(users["user_id"].max() + 1, -1, dtype=np.int64)
+        self.user_age[users["user_id"].to_numpy()] = age_codes
+
+        # Rating counts, sums and sums of squares per title x gender x age group
+        self.shape = (len(self.titles), len(self.genders), len(self.ages))
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.sums = np.zeros(self.shape, dtype=np.float64)
+        self.squares = np.zeros(self.shape, dtype=np.float64)
+
+    def partial(self):
+        # Create an empty aggregate which shares the dimension lookups
+        partial = copy.copy(self)
+        partial.counts = np.zeros(self.shape, dtype=np.int64)
+        partial.sums = np.zeros(self.shape, dtype=np.float64)
+        partial.squares = np.zeros(self.shape, dtype=np.float64)
+
+        return partial
+
+    def merge(self, other):
+        # Fold another partial aggregate of the same dimensions into this one
+        self.counts += other.counts
+        self.sums += other.sums
+        self.squares += other.squares
+
+    def add(self, ratings):
+        # Look up the dimension codes, ratings with unknown ids are skipped like in a merge
+        title = lookup_codes(self.movie_title, ratings["movie_id"])
+        gender = lookup_codes(self.user_gender, ratings["user_id"])
+        age = lookup_codes(self.user_age, ratings["user_id"])
+        known = (title >= 0) & (gender >= 0)
+
+        cells = np.ravel_multi_index(
+            (title[known], gender[known], age[known]), self.shape
         )
+        rating = np.asarray(ratings["rating"], dtype=np.float64)[known]
+
+        size = self.counts.size
+        if len(cells) >= size:
+            # Reduce large tables into the cells with grouped bincount() sums
+            self.counts += np.bincount(cells, minlength=size).reshape(self.shape)
+            self.sums += np.bincount(cells, weights=rating, minlength=size).reshape(
+                self.shape
+            )
+            self.squares += np.bincount(
+                cells, weights=rating**2, minlength=size
+            ).reshape(self.shape)
+        else:
+            # Update only the touched cells so small batches cost O(batch)
+            np.add.at(self.counts.reshape(-1), cells, 1)
+            np.add.at(self.sums.reshape(-1), cells, rating)
+            np.add.at(self.squares.reshape(-1), cells, rating**2)
+
+    def genre_aggregates(self):
+        # Multiply the sparse title x genre matrix by the per title aggregates,
+        # this costs O(titles x genres) whatever the number of ratings is
+        shape = (len(self.genres),) + self.shape[1:]
+        counts = np.zeros(shape, dtype=np.int64)
+        sums = np.zeros(shape, dtype=np.float64)
+        np.add.at(counts, self.genre_codes, self.counts[self.genre_titles])
+        np.add.at(sums, self.genre_codes, self.sums[self.genre_titles])
+
+        return counts, sums
+
+    def titles_released(self, start_year, end_year):
+        # Slice the codes of titles released between the years from the index
+        last = len(self.year_offsets) - 1
+        start = np.clip(start_year - self.first_year, 0, last)
+        end = np.clip(end_year - self.first_year + 1, 0, last)
+
+        return np.sort(
+            self.year_order[self.year_offsets[start] : self.year_offsets[end]]
+        )
+
+    def title_gender_count(self, titles=slice(None)):
+        # Number of ratings per title x gender
+        return self.counts[titles].sum(axis=2)
 
-        # Merge the three DataFrames into one consolidated DataFrame
-        self.data = pd.merge(pd.merge(self.ratings, self.users), self.movies)
+    def title_gender_mean_rating(self, titles=slice(None)):
+        # Mean rating per title x gender, NaN where a title has no ratings
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums[titles].sum(axis=2) / self.title_gender_count(titles)
 
-    def get_filtered_data(self):
-        # Extract the release year from the title and add a new 'release_year' column as integer type
-        self.data["release_year"] = (
-            self.data["title"].str.extract(r"\((\d{4})\)").astype(int)
+    def title_gender_mean_age(self, titles=slice(None)):
+        # Mean age of the users who rated a title, per gender
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.counts[titles] @ self.ages) / self.title_gender_count(titles)
+
+
+class MovieLens:
+    def __init__(
+        self,
+        users_file,
+        movies_file,
+        ratings_file,
+        use_cache=True,
+        chunksize=None,
+        query_cache_size=32,
+    ):
+        # Create DataFrame from the users table
+        self.users = read_dat_table(users_file, USERS_COLUMNS, use_cache)
+
+        # Create DataFrame from the movies table
+        self.movies = read_dat_table(movies_file, MOVIES_COLUMNS, use_cache)
+
+        # Per title aggregates of the ratings keyed by integer codes
+        self.engine = RatingsEngine(self.users, self.movies)
+
+        if chunksize is None:
+            # Create DataFrame from the ratings table, appended batches are kept
+            # apart and concatenated only when the ratings are accessed
+            self.rating_batches = [
+                read_dat_table(ratings_file, RATINGS_COLUMNS, use_cache)
+            ]
+            self.engine.add(self.rating_batches[0])
+        else:
+            # Out-of-core mode: fold the ratings chunk by chunk into the aggregates,
+            # so only one chunk of the ratings table is in memory at a time
+            self.rating_batches = None
+            for chunk in iter_dat_chunks(ratings_file, RATINGS_COLUMNS, chunksize):
+                partial = self.engine.partial()
+                partial.add(chunk)
+                self.engine.merge(partial)
+
+        # Derived tables built on demand, see get_cached_table()
+        self.cache = {}
+
+        # Results of the parameterized queries, the least recently used are evicted,
+        # see get_cached_query()
+        self.query_cache = OrderedDict()
+        self.query_cache_size = query_cache_size
+
+    @property
+    def ratings(self):
+        # The raw ratings are not kept in the out-of-core mode
+        if self.rating_batches is None:
+            raise ValueError("Ratings are not kept in memory in chunked mode")
+
+        # Concatenate the appended rating batches into one DataFrame
+        if len(self.rating_batches) > 1:
+            self.rating_batches = [pd.concat(self.rating_batches, ignore_index=True)]
+
+        return self.rating_batches[0]
+
+    def append_ratings(self, batch):
+        # Cast the new ratings to the compact dtypes of the ratings table
+        batch = batch[list(RATINGS_COLUMNS)].astype(RATINGS_COLUMNS)
+
+        # Update the running aggregates with the new ratings only
+        self.engine.add(batch)
+        if self.rating_batches is not None:
+            self.rating_batches.append(batch)
+
+        # Derived tables are rebuilt from the aggregates on the next request
+        self.clear_cache()
+
+    @property
+    def data(self):
+        # Merge the three DataFrames into one consolidated DataFrame on first access
+        return self.get_cached_table(
+            "data", lambda: pd.merge(pd.merge(self.ratings, self.users), self.movies)
         )
 
-        # Filter movies by release year from 1990 to 2000
-        self.data = self.data.loc[
-            (self.data["release_year"] >= 1990) & (self.data["release_year"] <= 2000)
-        ]
+    def get_cached_table(self, name, build):
+        # Build the derived table on the first request and reuse it afterwards
+        if name not in self.cache:
+            self.cache[name] = build()
 
-        return self.data
+        return self.cache[name]
 
-    def movies_rating_count(self):
-        # Invoke the get_filtered_data() function and get filtered DataFrame
-        filtered_data = self.get_filtered_data()
+    def get_cached_query(self, key, build):
+        # Reuse a recent query result, keep at most query_cache_size results
+        if key in self.query_cache:
+            self.query_cache.move_to_end(key)
+            return self.query_cache[key]
+
+        result = self.query_cache[key] = build()
+        if len(self.query_cache) > self.query_cache_size:
+            self.query_cache.popitem(last=False)
+
+        return result
+
+    def clear_cache(self):
+        # Drop all derived tables, must be called after the base tables are changed
+        self.cache.clear()
+        self.query_cache.clear()
+
+    def get_release_years(self):
+        def build():
+            # Extract the release year once per movie instead of once per rating
+            years = self.movies["title"].str.extract(r"\((\d{4})\)")[0].astype(int)
+            years.index = self.movies["movie_id"]
+
+            return self.data["movie_id"].map(years).rename("release_year")
+
+        return self.get_cached_table("release_year", build)
+
+    def get_filtered_data(self, start_year=1990, end_year=2000):
+        # Filtered copies of the merged table are not cached, each could be as
+        # large as the ratings table
+        # Add the 'release_year' column to a copy, self.data is never mutated
+        data = self.data.assign(release_year=self.get_release_years())
 
-        # Get average movies rating
-        mean_rating = filtered_data.pivot_table(
-            "rating", index="title", columns="gender", aggfunc="mean"
-        ).dropna()
+        # Filter movies by release year
+        return data.loc[
+            (data["release_year"] >= start_year) & (data["release_year"] <= end_year)
+        ]
+
+    def get_mean_age(self):
+        def build():
+            # Get users average age for each movie by gender
+            engine = self.engine
+            return pd.DataFrame(
+                engine.title_gender_mean_age(),
+                index=engine.titles,
+                columns=engine.genders,
+            )
+
+        return self.get_cached_table("mean_age", build)
+
+    def genre_ratings(self, by=("gender", "age")):
+        def build():
+            engine = self.engine
+            counts, sums = engine.genre_aggregates()
+
+            # Sum up the genre aggregates over the dimensions not in 'by'
+            levels = {"gender": engine.genders, "age": engine.age_groups}
+            unknown = set(by) - set(levels)
+            if unknown:
+                raise ValueError(f"Unknown genre dimensions: {sorted(unknown)}")
+            axes = tuple(
+                axis for axis, name in enumerate(levels, start=1) if name not in by
+            )
+            counts = counts.sum(axis=axes)
+            sums = sums.sum(axis=axes)
+
+            # Get the number of ratings and mean rating by genre and dimensions
+            index = pd.MultiIndex.from_product(
+                [engine.genres] + [levels[name] for name in levels if name in by]
+            )
+            genre_ratings = pd.DataFrame(
+                {"count": counts.reshape(-1), "rating_sum": sums.reshape(-1)},
+                index=index,
+            )
+            genre_ratings = genre_ratings[genre_ratings["count"] > 0]
+            genre_ratings["mean_rating"] = (
+                genre_ratings.pop("rating_sum") / genre_ratings["count"]
+            )
+
+            return genre_ratings
+
+        return self.get_cached_query(("genre_ratings", tuple(by)), build)
+
+    def divisive_movies(
+        self, by="difference", min_count=250, top_k=10, ascending=False
+    ):
+        def build():
+            engine = self.engine
+
+            # Per title sufficient statistics, keep titles with enough ratings
+            counts = engine.title_gender_count()
+            total = counts.sum(axis=1)
+            titles = np.flatnonzero((total >= min_count) & (counts > 0).all(axis=1))
+            counts, total = counts[titles], total[titles]
+            sums = engine.sums[titles].sum(axis=2)
+            squares = engine.squares[titles].sum(axis=(1, 2))
+
+            # Rating difference between the genders (last minus first, M - F)
+            # and the sample standard deviation of the ratings across all users
+            mean_rating = sums / counts
+            rating_sum = sums.sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                variance = (squares - rating_sum**2 / total) / (total - 1)
+            stats = {
+                "difference": mean_rating[:, -1] - mean_rating[:, 0],
+                "std": np.sqrt(np.maximum(variance, 0)),
+            }
+            if by not in stats:
+                raise ValueError(f"Unknown ranking: {by}")
+
+            # Select the top K titles with a partial sort, then order only those
+            key = stats[by] if ascending else -stats[by]
+            key = np.where(np.isnan(key), np.inf, key)
+            k = min(top_k, len(key))
+            top = np.argpartition(key, k - 1)[:k] if k else np.arange(0)
+            top = top[np.argsort(key[top], kind="stable")]
+
+            divisive = pd.DataFrame(
+                mean_rating[top],
+                index=engine.titles[titles[top]],
+                columns=engine.genders,
+            )
+            divisive["difference"] = stats["difference"][top]
+            divisive["std"] = stats["std"][top]
+            divisive["count"] = total[top]
+
+            return divisive
+
+        return self.get_cached_query(
+            ("divisive_movies", by, min_count, top_k, ascending), build
+        )
 
-        # Count the number of ratings for each movie
-        rating_by_title = filtered_data.groupby("title").size()
+    def query_ratings(
+        self,
+        start_year=1990,
+        end_year=2000,
+        min_count=500,
+        top_n=20,
+        sort_by="title",
+        ascending=True,
+    ):
+        def build():
+            engine = self.engine
+
+            # Get titles released in the year range from the release-year index
+            titles = engine.titles_released(start_year, end_year)
+
+            # Keep movies with enough ratings which were rated by both genders
+            counts = engine.title_gender_count(titles)
+            total = counts.sum(axis=1)
+            selected = (total >= min_count) & (counts > 0).all(axis=1)
+            titles, total = titles[selected], total[selected]
+            mean_rating = engine.title_gender_mean_rating(titles)
+
+            # Get sort key values, titles are coded in alphabetical order
+            if sort_by == "title":
+                key = titles
+            elif sort_by == "count":
+                key = total
+            elif sort_by == "mean":
+                key = engine.sums[titles].sum(axis=(1, 2)) / total
+            elif sort_by in engine.genders:
+                key = mean_rating[:, engine.genders.get_loc(sort_by)]
+            else:
+                raise ValueError(f"Unknown sort key: {sort_by}")
+
+            # Sort with a stable sort, so ties keep alphabetical order, and take top N
+            order = np.argsort(key if ascending else -key, kind="stable")[:top_n]
+
+            return pd.DataFrame(
+                mean_rating[order],
+                index=engine.titles[titles[order]],
+                columns=engine.genders,
+            )
+
+        return self.get_cached_query(
+            ("query", start_year, end_year, min_count, top_n, sort_by, ascending),
+            build,
+        )
 
-        # Select 20 movies with high ratings (at least 500 ratings)
-        highly_rated_movies = mean_rating.loc[
-            rating_by_title.index[rating_by_title >= 500]
-        ].head(20)
+    def movies_rating_count(self):
+        # Select 20 movies released between 1990 and 2000 with at least 500 ratings
+        highly_rated_movies = self.query_ratings(
+            start_year=1990, end_year=2000, min_count=500, top_n=20
+        )
 
         return highly_rated_movies
 
     def average_age_count(self):
         # Get movies titles from movies_rating_count() handled data
-        movies_titles = self.movies_rating_count().reset_index()[["title"]]
+        movies_titles = self.movies_rating_count().index
 
-        # Filter original DataFrame by movies titles
-        users_age = self.data[self.data["title"].isin(movies_titles["title"])]
-
-        # Get users average age
-        mean_age = users_age.pivot_table(
-            index="title", values="age", columns="gender", aggfunc="mean"
-        )
+        # Get users average age for the selected movies
+        mean_age = self.get_mean_age().loc[movies_titles]
 
         return mean_age
 
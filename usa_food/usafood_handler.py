@@ -1,4 +1,11 @@
+import glob
+import hashlib
 import json
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
 import numpy as np
@@ -23,53 +30,434 @@ HEATMAP_COLORS = {
 }
 
 
+def iter_json_array(path, block_size=1 << 16):
+    # Parse the top-level JSON array of the file one element at a time
+    decoder = json.JSONDecoder()
+    with open(path) as file:
+        buffer = file.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"JSON array expected: {path}")
+        position = 1
+        end_of_file = False
+
+        while True:
+            # Skip whitespace and separators between the elements
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+
+            # A number cut by the end of the buffer decodes as a shorter number,
+            # so the element must be followed by a separator or the end of file
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+                complete = end_of_file or (
+                    end < len(buffer) and buffer[end] in " \t\r\n,]"
+                )
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                complete = False
+
+            if not complete:
+                # The element is not complete yet, read the next block
+                block = file.read(block_size)
+                end_of_file = not block
+                buffer = buffer[position:] + block
+                position = 0
+                continue
+
+            position = end
+            yield element
+
+
+class NutrientTableBuilder:
+    def __init__(self, capacity=1024):
+        # Preallocated typed buffers with one row per nutrient value of a food
+        self.nutrient_codes = np.empty(capacity, dtype=np.int32)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+        # Offsets of each food rows in the buffers
+        self.offsets = [0]
+
+        # Food level columns
+        self.food_ids = []
+        self.food_descriptions = []
+        self.food_groups = []
+        self.manufacturers = []
+
+        # Codes of the distinct (description, group, units) nutrients
+        self.nutrient_keys = {}
+
+    @classmethod
+    def from_records(cls, records):
+        # Allocate the buffers once for all nutrients of the records
+        builder = cls(capacity=sum(len(rec["nutrients"]) for rec in records))
+        for rec in records:
+            builder.add(rec)
+
+        return builder
+
+    def add(self, rec):
+        # Add food info
+        self.food_ids.append(rec["id"])
+        self.food_descriptions.append(rec.get("description"))
+        self.food_groups.append(rec.get("group"))
+        self.manufacturers.append(rec.get("manufacturer"))
+
+        # Double the buffers capacity when they are full
+        nutrients = rec["nutrients"]
+        end = self.size + len(nutrients)
+        if end > len(self.values):
+            capacity = max(end, 2 * len(self.values))
+            self.nutrient_codes = np.resize(self.nutrient_codes, capacity)
+            self.values = np.resize(self.values, capacity)
+
+        # Fill the buffers with the food nutrients
+        nutrient_keys = self.nutrient_keys
+        for row, nutrient in enumerate(nutrients, start=self.size):
+            key = (nutrient["description"], nutrient["group"], nutrient["units"])
+            code = nutrient_keys.get(key)
+            if code is None:
+                code = nutrient_keys[key] = len(nutrient_keys)
+            self.nutrient_codes[row] = code
+            value = nutrient["value"]
+            self.values[row] = np.nan if value is None else value
+
+        self.size = end
+        self.offsets.append(end)
+
+    def build(self):
+        # Get food position of each row from the offsets
+        counts = np.diff(self.offsets)
+        foods = np.repeat(np.arange(len(counts)), counts)
+        codes = self.nutrient_codes[: self.size]
+        # Adding 0.0 replaces -0.0 with 0.0 to compare values by their bits
+        values = self.values[: self.size] + 0.0
+
+        # Drop duplicates by hashing integer keys (food, nutrient, value bits)
+        keys = pd.DataFrame(
+            {"food": foods, "code": codes, "value": values.view(np.int64)}
+        )
+        unique = ~keys.duplicated().to_numpy()
+        foods, codes, values = foods[unique], codes[unique], values[unique]
+
+        # Keep one empty row for foods without nutrients, as an outer merge does
+        empty = np.flatnonzero(counts == 0)
+        foods = np.concatenate([foods, empty])
+        codes = np.concatenate([codes, np.full(len(empty), -1, dtype=codes.dtype)])
+        values = np.concatenate([values, np.full(len(empty), np.nan)])
+
+        # Decode columns by taking from the distinct values, code -1 takes NaN
+        def take(distinct, codes):
+            return np.append(np.array(distinct, dtype=object), np.nan)[codes]
+
+        nutrient_keys = list(self.nutrient_keys)
+        descriptions = [key[0] for key in nutrient_keys]
+        groups = [key[1] for key in nutrient_keys]
+        units = [key[2] for key in nutrient_keys]
+
+        return pd.DataFrame(
+            {
+                "value": values,
+                "units": take(units, codes),
+                "nutrient": take(descriptions, codes),
+                "nutgroup": take(groups, codes),
+                "id": np.asarray(self.food_ids)[foods],
+                "food": take(self.food_descriptions, foods),
+                "fgroup": take(self.food_groups, foods),
+                "manufacturer": take(self.manufacturers, foods),
+            }
+        )
+
+
+def file_digest(path):
+    # Hash the file content by blocks
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def load_cached_table(cache_path):
+    # Restore the table columns, text columns are stored as codes and categories,
+    # return None when the cache is missing or broken
+    try:
+        with np.load(cache_path) as cache:
+            table = {}
+            for name in cache["columns"].tolist():
+                if f"{name}.codes" in cache:
+                    table[name] = pd.Categorical.from_codes(
+                        cache[f"{name}.codes"],
+                        cache[f"{name}.categories"].astype(object),
+                    ).astype(object)
+                else:
+                    table[name] = cache[name]
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+    return pd.DataFrame(table)
+
+
+def save_cached_table(cache_path, table):
+    arrays = {"columns": np.array(table.columns, dtype=str)}
+    for name, column in table.items():
+        if not pd.api.types.is_numeric_dtype(column):
+            codes, categories = pd.factorize(column)
+            arrays[f"{name}.codes"] = codes.astype(np.int32)
+            arrays[f"{name}.categories"] = np.array(categories, dtype=str)
+        else:
+            arrays[name] = column.to_numpy()
+
+    # Write a temporary file and move it into place, so an interrupted save never
+    # leaves a truncated cache, skip caching if the dataset folder is read-only
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class NutrientRankIndex:
+    def __init__(self):
+        # Ranked arrays of each nutrient, keyed by the nutrient name
+        self.nutrients = {}
+
+    def add(self, nutrients_data):
+        # Rank only the new rows and merge them into the ranked nutrients
+        data = nutrients_data.dropna(subset=["value", "nutrient"])
+        for nutrient, rows in data.groupby("nutrient", sort=False):
+            columns = {
+                "value": rows["value"].to_numpy(),
+                "id": rows["id"].to_numpy(),
+                "food": rows["food"].to_numpy(dtype=object),
+                "fgroup": rows["fgroup"].fillna("").to_numpy(dtype=object),
+            }
+            entry = self.nutrients.get(nutrient)
+            if entry is None:
+                self.nutrients[nutrient] = self.rank(columns)
+            else:
+                self.nutrients[nutrient] = self.merge(entry, self.rank(columns))
+
+    @staticmethod
+    def rank(columns):
+        # Sort the foods by value, in descending order
+        order = np.argsort(-columns["value"], kind="stable")
+        entry = {name: column[order] for name, column in columns.items()}
+
+        # Partition the ranked foods by food group, keeping the value order
+        group_order = np.argsort(entry["fgroup"], kind="stable")
+        entry["group_order"] = group_order
+        entry["groups"], starts = np.unique(
+            entry["fgroup"][group_order], return_index=True
+        )
+        entry["group_offsets"] = np.append(starts, len(group_order))
+
+        return entry
+
+    @staticmethod
+    def merge(entry, new):
+        # Insert the new foods after the ranked foods with the same value
+        positions = np.searchsorted(-entry["value"], -new["value"], side="right")
+        merged = {
+            name: np.insert(entry[name], positions, new[name])
+            for name in ["value", "id", "food", "fgroup"]
+        }
+
+        # Ranked positions of the old and new foods in the merged arrays
+        old_count = len(entry["value"])
+        old_positions = np.arange(old_count) + np.searchsorted(
+            positions, np.arange(old_count), side="right"
+        )
+        new_positions = positions + np.arange(len(positions))
+
+        # Merge the food group partitions, both are ordered by group and position
+        groups = np.union1d(entry["groups"], new["groups"])
+        old_codes = np.repeat(
+            np.searchsorted(groups, entry["groups"]), np.diff(entry["group_offsets"])
+        )
+        new_codes = np.repeat(
+            np.searchsorted(groups, new["groups"]), np.diff(new["group_offsets"])
+        )
+        old_order = old_positions[entry["group_order"]]
+        new_order = new_positions[new["group_order"]]
+        size = len(merged["value"])
+        merged["group_order"] = np.insert(
+            old_order,
+            np.searchsorted(old_codes * size + old_order, new_codes * size + new_order),
+            new_order,
+        )
+        merged["groups"] = groups
+        group_sizes = np.bincount(old_codes, minlength=len(groups)) + np.bincount(
+            new_codes, minlength=len(groups)
+        )
+        merged["group_offsets"] = np.append(0, np.cumsum(group_sizes))
+
+        return merged
+
+    def positions(self, nutrient, fgroup=None):
+        # Get ranked positions of the food group foods, None for all foods
+        entry = self.nutrients[nutrient]
+        if fgroup is None:
+            return entry, None
+
+        group = np.searchsorted(entry["groups"], fgroup)
+        if group == len(entry["groups"]) or entry["groups"][group] != fgroup:
+            return entry, np.arange(0)
+        offsets = entry["group_offsets"]
+
+        return entry, entry["group_order"][offsets[group] : offsets[group + 1]]
+
+    def table(self, entry, positions):
+        return pd.DataFrame(
+            {name: entry[name][positions] for name in ["id", "food", "fgroup", "value"]}
+        )
+
+    def top(self, nutrient, k=10, fgroup=None):
+        # Get k foods with the largest nutrient values
+        entry, positions = self.positions(nutrient, fgroup)
+        if positions is None:
+            return self.table(entry, slice(0, k))
+
+        return self.table(entry, positions[:k])
+
+    def above(self, nutrient, threshold, fgroup=None):
+        # Get foods with the nutrient value of at least threshold
+        entry, positions = self.positions(nutrient, fgroup)
+        values = entry["value"] if positions is None else entry["value"][positions]
+        count = np.searchsorted(-values, -threshold, side="right")
+        if positions is None:
+            return self.table(entry, slice(0, count))
+
+        return self.table(entry, positions[:count])
+
+
 class UsaFood:
-    def __init__(self, db):
+    def __init__(self, db, nutrients_data=None):
         self.db = db
+        # Memoized nutrients table, see get_nutrients()
+        self.nutrients_data = nutrients_data
+        # Memoized quantile tables, see get_nutrient_quantiles()
+        self.nutrient_quantiles = {}
+        # Ranked foods by nutrient, see get_rank_index()
+        self.rank_index = None
+
+    @classmethod
+    def from_json(cls, path, use_cache=True, streaming=False):
+        if use_cache:
+            # Cache file name is keyed by the hash of the JSON database content,
+            # the file is hashed only when the cache is used
+            cache_path = f"{path}.{file_digest(path)[:16]}.cache.npz"
+
+            # Warm start: load the nutrients table without parsing JSON,
+            # a broken cache is rebuilt and overwritten below
+            nutrients_data = load_cached_table(cache_path)
+            if nutrients_data is not None:
+                return cls(db=None, nutrients_data=nutrients_data)
+
+        if streaming:
+            # Feed food records to the table builder one by one,
+            # the list of records is never created
+            builder = NutrientTableBuilder()
+            for rec in iter_json_array(path):
+                builder.add(rec)
+            usafood = cls(db=None, nutrients_data=builder.build())
+        else:
+            with open(path) as file:
+                usafood = cls(db=json.load(file))
+
+        if use_cache:
+            # Remove caches of the previous database versions
+            for stale_path in glob.glob(f"{glob.escape(path)}.*.cache.npz"):
+                os.remove(stale_path)
+            save_cached_table(cache_path, usafood.get_nutrients())
+
+        return usafood
 
     def get_nutrients(self):
-        # Create a DataFrame with specific columns for extraction
-        info = pd.DataFrame(
-            self.db, columns=["description", "group", "id", "manufacturer"]
+        # Flatten all products nutrients into one table in a single pass, once
+        if self.nutrients_data is None:
+            self.nutrients_data = NutrientTableBuilder.from_records(self.db).build()
+
+        return self.nutrients_data
+
+    def add_foods(self, records):
+        # Flatten only the new food records
+        new_data = NutrientTableBuilder.from_records(records).build()
+        self.nutrients_data = pd.concat(
+            [self.get_nutrients(), new_data], ignore_index=True
         )
+        if self.db is not None:
+            self.db.extend(records)
 
-        # Collect all products nutrients
-        nutrients = [
-            pd.DataFrame(rec["nutrients"]).assign(id=rec["id"])
-            for rec in self.db
-        ]
+        # Update the ranked index for the new rows, quantiles are recomputed
+        if self.rank_index is not None:
+            self.rank_index.add(new_data)
+        self.nutrient_quantiles.clear()
 
-        # Concat all objects
-        nutrients = pd.concat(nutrients, ignore_index=True)
-        nutrients = nutrients.drop_duplicates()
+    def get_rank_index(self):
+        # Build the ranked foods index once
+        if self.rank_index is None:
+            self.rank_index = NutrientRankIndex()
+            self.rank_index.add(self.get_nutrients())
 
-        # Rename columns with the same names
-        info = info.rename(
-            columns={"description": "food", "group": "fgroup"},
-            copy=False
-        )
-        nutrients = nutrients.rename(
-            columns={"description": "nutrient", "group": "nutgroup"},
-            copy=False
+        return self.rank_index
+
+    def top_foods(self, nutrient, k=10, fgroup=None):
+        # Get foods richest in the nutrient, within a food group if set
+        return self.get_rank_index().top(nutrient, k, fgroup)
+
+    def foods_above(self, nutrient, threshold, fgroup=None):
+        # Get foods with the nutrient value of at least threshold
+        return self.get_rank_index().above(nutrient, threshold, fgroup)
+
+    def get_nutrient_quantiles(self, quantiles=(0.1, 0.5, 0.9)):
+        quantiles = tuple(quantiles)
+        if quantiles in self.nutrient_quantiles:
+            return self.nutrient_quantiles[quantiles]
+
+        data = self.get_nutrients().dropna(subset=["value", "nutrient", "fgroup"])
+
+        # Code each (nutrient, food group) cell with one integer
+        nutrient_codes, nutrients = pd.factorize(data["nutrient"], sort=True)
+        fgroup_codes, fgroups = pd.factorize(data["fgroup"], sort=True)
+        cells = nutrient_codes.astype(np.int64) * len(fgroups) + fgroup_codes
+
+        # Sort values by cell and value once, then find cells boundaries
+        order = np.lexsort((data["value"].to_numpy(), cells))
+        values = data["value"].to_numpy()[order]
+        cells, starts, counts = np.unique(
+            cells[order], return_index=True, return_counts=True
         )
 
-        # Merge two DataFrames
-        nutrients_data = pd.merge(nutrients, info, on="id", how="outer")
+        # Linear interpolation between the closest ranks, as np.percentile() does
+        table = {}
+        for q in quantiles:
+            position = starts + q * (counts - 1)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            table[q] = values[lower] + (values[upper] - values[lower]) * (
+                position - lower
+            )
 
-        return nutrients_data
+        index = pd.MultiIndex.from_arrays(
+            [nutrients[cells // len(fgroups)], fgroups[cells % len(fgroups)]],
+            names=["nutrient", "fgroup"],
+        )
+        self.nutrient_quantiles[quantiles] = pd.DataFrame(table, index=index)
+
+        return self.nutrient_quantiles[quantiles]
 
     def get_vitamins_amount(self):
-        data = self.get_nutrients()
-
-        # Create table with all nutrients amount
-        nutr_amount = data.pivot_table(
-            values="value",
-            index="fgroup",
-            columns="nutrient",
-            aggfunc=lambda x: np.percentile(x, 50),
-            dropna=True,
-            fill_value=0,
-        )
+        # Create table with all nutrients median amount
+        median = self.get_nutrient_quantiles()[0.5]
+        nutr_amount = median.unstack("nutrient", fill_value=0)
 
         # Filter columns by Vitamins
         vit_amount = nutr_amount.filter(like="Vitamin", axis=1)
@@ -81,10 +469,8 @@ class UsaFood:
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(13, 11))
 
         # Plotting the first plot showing median values by food elements (ax1)
-        nutr_data = self.get_nutrients()
-
-        # Get grouped average nutrient values
-        ave_nutr_data = nutr_data.groupby(["nutrient", "fgroup"])["value"].quantile(0.5)
+        # Get grouped median nutrient values
+        ave_nutr_data = self.get_nutrient_quantiles()[0.5]
 
         # Extract Zinc values for visualisation
         ave_nutr_zinc = ave_nutr_data["Zinc, Zn"].sort_values(ascending=False)
@@ -156,13 +542,28 @@ class UsaFood:
         return self.db
 
 
+def benchmark_json_loading(path):
+    # Compare peak memory of loading the whole JSON and of the streaming parser
+    for streaming in (False, True):
+        tracemalloc.start()
+        start = time.perf_counter()
+        UsaFood.from_json(path, use_cache=False, streaming=streaming).get_nutrients()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        mode = "Streaming" if streaming else "json.load()"
+        print(f"{mode}: {elapsed:.2f} s, peak memory {peak / 2**20:.1f} MiB")
+
+
 if __name__ == "__main__":
     try:
-        usafood = UsaFood(
-            db=json.load(
-                open("../datasets/usa_food/usafood_db.json")
-            )
-        )
+        if "--benchmark" in sys.argv:
+            # Report peak memory of the JSON database loading modes
+            benchmark_json_loading("../datasets/usa_food/usafood_db.json")
+            sys.exit()
+
+        usafood = UsaFood.from_json("../datasets/usa_food/usafood_db.json")
         usafood.data_visualisation()
 
     except FileNotFoundError as err: